@@ -1,6 +1,7 @@
-import aiosmtplib, os, logging
+import aiosmtplib, asyncio, os, logging
 from email.message import EmailMessage
 from datetime import datetime, timezone
+from typing import Optional
 
 log = logging.getLogger(__name__)
 
@@ -10,6 +11,11 @@ SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
 MAIL_FROM = os.getenv("MAIL_FROM", SMTP_USER or "noreply@example.com")
 MAIL_TO   = os.getenv("MAIL_TO", "johannes.dachs@gmx.de")
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "100"))
+
+# Begrenzte Queue + ein Worker statt create_task je Mail
+_mail_q: Optional[asyncio.Queue] = None
+_mail_task: Optional[asyncio.Task] = None
 
 async def send_mail(subject: str, body: str):
     if not SMTP_HOST or not MAIL_TO:
@@ -26,6 +32,51 @@ async def send_mail(subject: str, body: str):
     )
     log.info("Email sent: %s", subject)
 
+async def _mail_worker(q: asyncio.Queue):
+    while True:
+        subject, body, args = await q.get()
+        try:
+            if args:
+                # Formatierung erst hier, nicht im Aufrufer; datetime -> fmt_ts()
+                body = body % tuple(fmt_ts(a) if isinstance(a, datetime) else a for a in args)
+            await send_mail(subject, body)
+        except Exception as e:
+            log.warning("email failed: %s (%s)", subject, e)
+        finally:
+            q.task_done()
+
+def enqueue_mail(subject: str, body: str, *args) -> bool:
+    """Mail zum Versand einreihen; bei voller Queue wird sie verworfen.
+
+    Mit `args` ist `body` ein %-Template, das erst der Worker ausfüllt.
+    """
+    global _mail_q, _mail_task
+    if _mail_q is None:
+        _mail_q = asyncio.Queue(maxsize=MAIL_QUEUE_SIZE)
+        _mail_task = asyncio.create_task(_mail_worker(_mail_q))
+    try:
+        _mail_q.put_nowait((subject, body, args))
+        return True
+    except asyncio.QueueFull:
+        log.warning("mail queue full; dropping email: %s", subject)
+        return False
+
+async def close_mailer(timeout: float = 10.0):
+    """Beim Shutdown aufrufen: Queue noch abarbeiten (max. `timeout` s), dann Worker beenden."""
+    global _mail_q, _mail_task
+    if _mail_task is None:
+        return
+    try:
+        await asyncio.wait_for(_mail_q.join(), timeout)
+    except asyncio.TimeoutError:
+        log.warning("mail queue not drained on shutdown; dropping %d email(s)", _mail_q.qsize())
+    _mail_task.cancel()
+    try:
+        await _mail_task
+    except asyncio.CancelledError:
+        pass
+    _mail_q = _mail_task = None
+
 def fmt_ts(ts=None):
     ts = ts or datetime.now(timezone.utc)
     return ts.astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
@@ -1,22 +1,26 @@
 # backend/main.py
 import os
-import json
+import re
 import asyncio
 import logging
 from collections import deque
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional
 
-import httpx
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+import aiohttp
+import orjson
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, Field
 
-# OCPP 1.6 (ocpp==0.17.0)
-from ocpp.v16 import call, call_result
-from ocpp.v16 import ChargePoint as V16ChargePoint
-from ocpp.routing import on
-from ocpp.v16.enums import RegistrationStatus
+# OCPP 1.6 Central System (ocpp==0.17.0)
+from ocpp_cs import CentralSystem, broadcast_limit_kw, cp_registry, cp_status, now_iso
+# Preisabruf (eigene aiohttp-Session, beim Shutdown schließen)
+from price_provider import close_session as close_price_session
+# Mail-Worker (beim Shutdown Queue abarbeiten und beenden)
+from mailer import close_mailer
 
 # -----------------------------------------------------------------------------
 # Einstellungen / ENV
@@ -26,11 +30,7 @@ VERSION = "1.0.0"
 
 # Whitelist optional: nur diese CP-ID(s) zulassen; leer = alle
 CP_ID_ENV = os.getenv("CP_ID", "").strip()
-KNOWN_CP_IDS = set([CP_ID_ENV]) if CP_ID_ENV else set()
-
-# Netzparameter für Limit-Berechnung
-PHASES = int(os.getenv("PHASES", "3") or "3")
-VOLTAGE = float(os.getenv("VOLTAGE", "230") or "230")
+KNOWN_CP_IDS = frozenset([CP_ID_ENV]) if CP_ID_ENV else frozenset()
 
 # Preisquelle (aWATTar Deutschland)
 PRICE_API_URL = os.getenv("PRICE_API_URL", "https://api.awattar.de/v1/marketdata")
@@ -39,6 +39,12 @@ PRICE_API_URL = os.getenv("PRICE_API_URL", "https://api.awattar.de/v1/marketdata
 LAT = float(os.getenv("LAT", "48.83"))
 LON = float(os.getenv("LON", "12.86"))
 
+# Schreibpuffer der OCPP-WebSockets (Bytes)
+WS_WRITE_BUFFER_HIGH = 1024 * 1024
+WS_WRITE_BUFFER_LOW = 128 * 1024
+# Max. gepufferte, noch nicht verarbeitete OCPP-Nachrichten je Verbindung
+WS_RECV_QUEUE_SIZE = 64
+
 # CORS
 ALLOW_ORIGINS = [o.strip() for o in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",")]
 
@@ -59,7 +65,7 @@ class BufferHandler(logging.Handler):
         try:
             LOG_BUFFER.append(
                 {
-                    "ts": datetime.now(timezone.utc).isoformat(),
+                    "ts": now_iso(),
                     "level": record.levelname,
                     "logger": record.name,
                     "msg": record.getMessage(),
@@ -76,24 +82,24 @@ logging.getLogger("ocpp").addHandler(_buf)
 # -----------------------------------------------------------------------------
 # Hilfsfunktionen
 # -----------------------------------------------------------------------------
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+def clamp(x: float, lo: float, hi: float) -> float:
+    # NaN landet wie bei max/min auf hi (x <= hi ist False)
+    return lo if x < lo else x if x <= hi else hi
 
 
-def _round01(x: float) -> float:
-    return round(x * 10.0) / 10.0
+_OCPP_PATH_RE = re.compile(r"/*ocpp/+([^/]+)", re.IGNORECASE)
 
 
-def clamp(x: float, lo: float, hi: float) -> float:
-    return max(lo, min(hi, x))
+@lru_cache(maxsize=1024)
+def extract_cp_id_from_path(path: str) -> Optional[str]:
+    """CP-ID aus "/ocpp/<id>[/...]" lesen; ohne ID -> None."""
+    m = _OCPP_PATH_RE.match(path)
+    return m.group(1) if m else None
 
 
 # -----------------------------------------------------------------------------
-# Status / Registry
+# Konfiguration / Caches
 # -----------------------------------------------------------------------------
-cp_status: Dict[str, Dict[str, Any]] = {}
-cp_registry: Dict[str, "CentralSystem"] = {}
-
 # In-Memory Eco-Konfig
 ECO_CONFIG: Dict[str, Any] = {"sunny_kw": 11.0, "cloudy_kw": 3.7}
 
@@ -101,190 +107,49 @@ ECO_CONFIG: Dict[str, Any] = {"sunny_kw": 11.0, "cloudy_kw": 3.7}
 _price_cache: Dict[str, Any] = {"ts": None, "data": None}
 _weather_cache: Dict[str, Any] = {"ts": None, "data": None}
 
-
-def normalize_status(s: Optional[str]) -> str:
-    if not s:
-        return "unknown"
-    s = s.strip()
-    return s.replace(" ", "_").replace("-", "_").lower()
+# Gemeinsame HTTP-Session (Connection-Pool, Keep-Alive) für Preis/Wetter
+_http: Optional[aiohttp.ClientSession] = None
+# Fertig kodierte Antworten für / und /health (neu nur bei neuem Clock-Tick)
+_root_cache: Dict[str, Any] = {"ts": None, "data": None}
+_health_cache: Dict[str, Any] = {"ts": None, "data": None}
+_stats_cache: Dict[str, Any] = {"ts": None, "data": None}
 
 
-# -----------------------------------------------------------------------------
-# OCPP Central System
-# -----------------------------------------------------------------------------
-class CentralSystem(V16ChargePoint):
-    def __init__(self, id: str, connection):
-        super().__init__(id, connection)
-
-    async def push_limit_kw(self, kw: float, connector_id: int = 1, phases: Optional[int] = None, voltage: Optional[float] = None):
-        """Pusht ein TxProfile-Limit (Ampere) basierend auf kW."""
-        ph = phases or PHASES
-        volt = voltage or VOLTAGE
-        # typisches Mindestlimit: 6 A, viele EVSE akzeptieren 0,1 A Schritte
-        amps = max(6.0, _round01((kw * 1000.0) / (volt * ph)))
-        profile = {
-            "chargingProfileId": 2001,
-            "stackLevel": 2,
-            "chargingProfilePurpose": "TxProfile",
-            "chargingProfileKind": "Absolute",
-            "chargingSchedule": {
-                "chargingRateUnit": "A",
-                "chargingSchedulePeriod": [
-                    {"startPeriod": 0, "limit": amps, "numberPhases": ph}
-                ],
-            },
-        }
-        try:
-            res = await self.call(call.SetChargingProfile(connector_id=connector_id, cs_charging_profiles=profile))
-            st = cp_status.get(self.id) or {"id": self.id}
-            st["target_kw"] = round(kw, 3)
-            st["last_profile_status"] = getattr(res, "status", "")
-            st["last_seen"] = now_iso()
-            cp_status[self.id] = st
-            logging.getLogger("ocpp").info(
-                "%s: SetChargingProfile sent (%.1f A ~ %.2f kW) -> %s",
-                self.id,
-                amps,
-                kw,
-                getattr(res, "status", ""),
-            )
-        except Exception as e:
-            logging.getLogger("ocpp").warning("%s: push profile failed: %s", self.id, e)
-
-    async def clear_profile(self, connector_id: int = 1):
-        try:
-            await self.call(call.ClearChargingProfile(connector_id=connector_id))
-            logging.getLogger("ocpp").info("%s: ClearChargingProfile ok", self.id)
-        except Exception as e:
-            logging.getLogger("ocpp").warning("%s: ClearChargingProfile failed: %s", self.id, e)
-
-    # -------------------- OCPP Handlers --------------------
-    @on("BootNotification")
-    async def on_boot(self, charge_point_vendor: str, charge_point_model: str, **kwargs):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["vendor"] = charge_point_vendor
-        st["model"] = charge_point_model
-        st["status"] = "available"
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        logging.getLogger("ocpp").info("%s: BootNotification model=%s vendor=%s", self.id, charge_point_model, charge_point_vendor)
-        return call_result.BootNotificationPayload(current_time=now_iso(), interval=30, status=RegistrationStatus.accepted)
-
-    @on("Heartbeat")
-    async def on_heartbeat(self):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        return call_result.HeartbeatPayload(current_time=now_iso())
-
-    @on("StatusNotification")
-    async def on_status(self, connector_id: int, error_code: str, status: str, **kwargs):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["status"] = normalize_status(status)
-        st["error_code"] = error_code
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        return call_result.StatusNotificationPayload()
-
-    @on("StartTransaction")
-    async def on_start_transaction(self, connector_id: int, id_tag: str, timestamp: str, meter_start: int, reservation_id: Optional[int] = None):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["tx_active"] = True
-        st["session"] = {
-            "start": timestamp or now_iso(),
-            "end": None,
-            "est_end": None,
-            "start_meter_wh": float(meter_start),
-            "last_meter_wh": float(meter_start),
-        }
-        st["energy_kwh_session"] = 0.0
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        logging.getLogger("ocpp").info("%s: StartTransaction meter_start=%.1f Wh", self.id, float(meter_start))
-        return call_result.StartTransactionPayload(transaction_id=1, id_tag_info={"status": "Accepted"})
-
-    @on("MeterValues")
-    async def on_meter_values(self, connector_id: int, meter_value: list, transaction_id: Optional[int] = None):
-        power_kw = None
-        soc = None
-        latest_energy_wh = None
-
-        for mv in meter_value or []:
-            for sv in (mv.get("sampledValue") or []):
-                meas = (sv.get("measurand") or "").strip()
-                unit = (sv.get("unit") or "").strip()
-                val_str = sv.get("value")
-                try:
-                    val = float(val_str)
-                except Exception:
-                    continue
-                lower = meas.lower()
-                if "power.active.import" in lower:
-                    power_kw = val if unit.lower() == "kw" else (val / 1000.0)
-                elif "energy.active.import.register" in lower:
-                    latest_energy_wh = val if unit.lower() == "wh" else (val * 1000.0)
-                elif lower == "soc" or meas == "SoC":
-                    try:
-                        soc = int(val)
-                    except Exception:
-                        pass
-
-        st = cp_status.get(self.id) or {"id": self.id}
-        sess = st.get("session") or {}
-
-        if latest_energy_wh is not None:
-            if "start_meter_wh" not in sess or sess.get("start_meter_wh") is None:
-                sess["start_meter_wh"] = latest_energy_wh
-            sess["last_meter_wh"] = latest_energy_wh
-            diff_wh = max(0.0, latest_energy_wh - float(sess.get("start_meter_wh") or 0.0))
-            st["energy_kwh_session"] = round(diff_wh / 1000.0, 3)
-            st["session"] = sess
-
-        if power_kw is not None:
-            st["power_kw"] = round(power_kw, 3)
-        if soc is not None:
-            st["soc"] = soc
-
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        return call_result.MeterValuesPayload()
-
-    @on("StopTransaction")
-    async def on_stop_transaction(self, transaction_id: int, id_tag: str, timestamp: str, meter_stop: int, transaction_data: Optional[list] = None, reason: Optional[str] = None):
-        st = cp_status.get(self.id) or {"id": self.id}
-        sess = st.get("session") or {}
-        try:
-            stop_wh = float(meter_stop)
-            if "start_meter_wh" in sess and sess.get("start_meter_wh") is not None:
-                diff_wh = max(0.0, stop_wh - float(sess["start_meter_wh"]))
-                st["energy_kwh_session"] = round(diff_wh / 1000.0, 3)
-            sess["last_meter_wh"] = stop_wh
-        except Exception:
-            pass
-        sess["end"] = timestamp or now_iso()
-        st["session"] = sess
-        st["tx_active"] = False
-        st["last_seen"] = now_iso()
-        cp_status[self.id] = st
-        logging.getLogger("ocpp").info("%s: StopTransaction energy_kwh_session=%.3f", self.id, st.get("energy_kwh_session", 0.0))
-        return call_result.StopTransactionPayload()
-
-    @on("DataTransfer")
-    async def on_data_transfer(self, vendor_id: str, message_id: Optional[str] = None, data: Optional[str] = None):
-        logging.getLogger("ocpp").debug("%s: DataTransfer vendor_id=%s message_id=%s", self.id, vendor_id, message_id)
-        return call_result.DataTransferPayload(status="Accepted")
+def http_session() -> aiohttp.ClientSession:
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=75),
+            timeout=aiohttp.ClientTimeout(total=15, connect=5),
+        )
+    return _http
 
 
 # -----------------------------------------------------------------------------
 # WS-Adapter (Starlette WebSocket -> ocpp connection)
 # -----------------------------------------------------------------------------
 class WSConn:
-    def __init__(self, ws: WebSocket):
+    def __init__(self, ws: WebSocket, queue_size: int = WS_RECV_QUEUE_SIZE):
         self.ws = ws
         self._closed = False
+        # Begrenzte Queue: hängt die OCPP-Verarbeitung hinterher, blockiert _pump()
+        # und liest nicht weiter vom Socket -> Backpressure bis zur Wallbox
+        self.q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._reader = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        try:
+            while True:
+                await self.q.put(await self.ws.receive_text())
+        except Exception as e:
+            # Disconnect/Fehler an recv() weiterreichen
+            await self.q.put(e)
 
     async def recv(self) -> str:
-        return await self.ws.receive_text()
+        msg = await self.q.get()
+        if isinstance(msg, Exception):
+            raise msg
+        return msg
 
     async def send(self, msg: str):
         await self.ws.send_text(msg)
@@ -295,16 +160,41 @@ class WSConn:
 
     async def close(self):
         self._closed = True
+        self._reader.cancel()
+        if self.ws.client_state.name != "CONNECTED":
+            return
         try:
             await self.ws.close()
         except Exception:
             pass
 
 
+class WSWriteBufferMiddleware:
+    """Hebt die Schreibpuffer-Grenzen des Transports für WebSocket-Verbindungen an.
+
+    Best effort: uvicorn übergibt als `send` eine gebundene Methode seines
+    Protokolls, darüber ist der asyncio-Transport erreichbar. Mehrere kleine
+    OCPP-Frames landen so im Socket-Puffer statt auf drain() zu warten.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            transport = getattr(getattr(send, "__self__", None), "transport", None)
+            if transport is not None:
+                try:
+                    transport.set_write_buffer_limits(high=WS_WRITE_BUFFER_HIGH, low=WS_WRITE_BUFFER_LOW)
+                except Exception:
+                    pass
+        await self.app(scope, receive, send)
+
+
 # -----------------------------------------------------------------------------
 # FastAPI App + CORS
 # -----------------------------------------------------------------------------
-app = FastAPI(title=APP_TITLE, version=VERSION)
+app = FastAPI(title=APP_TITLE, version=VERSION, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -313,30 +203,58 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(WSWriteBufferMiddleware)
+
+
+@app.on_event("shutdown")
+async def on_stop():
+    if _http is not None:
+        await _http.close()
+    await close_price_session()
+    await close_mailer()
 
 
 # -----------------------------------------------------------------------------
 # Health / Root
 # -----------------------------------------------------------------------------
 @app.get("/")
-def root():
-    return {"ok": True, "app": APP_TITLE, "version": VERSION, "time": now_iso()}
+async def root():
+    ts = now_iso()
+    if _root_cache["ts"] != ts:
+        _root_cache["data"] = orjson.dumps({"ok": True, "app": APP_TITLE, "version": VERSION, "time": ts})
+        _root_cache["ts"] = ts
+    return Response(_root_cache["data"], media_type="application/json")
+
+
+@app.get("/health")
+async def health():
+    ts = now_iso()
+    if _health_cache["ts"] != ts:
+        _health_cache["data"] = orjson.dumps({"status": "ok", "as_of": ts})
+        _health_cache["ts"] = ts
+    return Response(_health_cache["data"], media_type="application/json")
 
 
 # -----------------------------------------------------------------------------
 # Live Logs
 # -----------------------------------------------------------------------------
 @app.get("/api/logs")
-def api_logs(limit: int = 200):
+async def api_logs(limit: int = 200):
     limit = max(10, min(500, int(limit or 200)))
-    return list(LOG_BUFFER)[-limit:]
+    return ORJSONResponse(list(LOG_BUFFER)[-limit:])
 
 
 # -----------------------------------------------------------------------------
 # OCPP WebSocket
 # -----------------------------------------------------------------------------
-@app.websocket("/ocpp/{cp_id}")
-async def ocpp_ws(websocket: WebSocket, cp_id: str):
+@app.websocket("/ocpp/{full_path:path}")
+async def ocpp_ws(websocket: WebSocket, full_path: str):
+    # Eine Route für "/ocpp/<id>" und "/ocpp/<id>/<tail>" – ID wird hier geparst
+    cp_id = extract_cp_id_from_path(websocket.url.path)
+    if cp_id is None:
+        await websocket.close(code=4030)
+        log.info("Reject WS without CP-ID: %s", websocket.url.path)
+        return
     if KNOWN_CP_IDS and cp_id not in KNOWN_CP_IDS:
         await websocket.close(code=4030)
         log.info("Reject WS for unknown CP-ID %s", cp_id)
@@ -349,10 +267,7 @@ async def ocpp_ws(websocket: WebSocket, cp_id: str):
     cp = CentralSystem(cp_id, conn)
     cp_registry[cp_id] = cp
 
-    st = cp_status.get(cp_id) or {"id": cp_id}
-    st.setdefault("status", "unknown")
-    st["last_seen"] = now_iso()
-    cp_status[cp_id] = st
+    cp_status[cp_id].last_seen = now_iso()
 
     try:
         await cp.start()
@@ -366,10 +281,9 @@ async def ocpp_ws(websocket: WebSocket, cp_id: str):
         except Exception:
             pass
         cp_registry.pop(cp_id, None)
-        st = cp_status.get(cp_id) or {"id": cp_id}
-        st["status"] = "disconnected"
-        st["last_seen"] = now_iso()
-        cp_status[cp_id] = st
+        st = cp_status[cp_id]
+        st.status = "disconnected"
+        st.last_seen = now_iso()
 
 
 # -----------------------------------------------------------------------------
@@ -381,12 +295,11 @@ async def api_price():
         # Cache 2 Minuten
         ts = _price_cache.get("ts")
         if ts and datetime.now(timezone.utc) - ts < timedelta(seconds=120):
-            return _price_cache["data"]
+            return Response(_price_cache["data"], media_type="application/json")
 
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.get(PRICE_API_URL)
+        async with http_session().get(PRICE_API_URL) as r:
             r.raise_for_status()
-            data = r.json()
+            data = await r.json(loads=orjson.loads)
 
         items = data.get("data") or []
         # marketprice ist EUR/MWh -> ct/kWh = price / 10
@@ -423,12 +336,13 @@ async def api_price():
             "below_or_equal_median": (current is not None and median is not None and current <= median),
             "series": series[:96],  # bis 24h x 15min (aWATTar kann stündlich sein; ok)
         }
+        # bereits kodiert cachen -> Cache-Hits kosten kein erneutes Serialisieren
         _price_cache["ts"] = datetime.now(timezone.utc)
-        _price_cache["data"] = payload
-        return payload
+        _price_cache["data"] = orjson.dumps(payload)
+        return Response(_price_cache["data"], media_type="application/json")
     except Exception as e:
         log.warning("price fetch failed: %s", e)
-        return JSONResponse({"error": str(e)}, status_code=502)
+        return ORJSONResponse({"error": str(e)}, status_code=502)
 
 
 # -----------------------------------------------------------------------------
@@ -439,17 +353,16 @@ async def api_weather():
     try:
         ts = _weather_cache.get("ts")
         if ts and datetime.now(timezone.utc) - ts < timedelta(seconds=120):
-            return _weather_cache["data"]
+            return Response(_weather_cache["data"], media_type="application/json")
 
         url = (
             "https://api.open-meteo.com/v1/forecast"
             f"?latitude={LAT}&longitude={LON}"
             "&current=cloud_cover,shortwave_radiation,temperature_2m,weather_code&timezone=auto"
         )
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.get(url)
+        async with http_session().get(url) as r:
             r.raise_for_status()
-            data = r.json()
+            data = await r.json(loads=orjson.loads)
 
         current = (data.get("current") or {})
         payload = {
@@ -460,54 +373,63 @@ async def api_weather():
             "weather_code": current.get("weather_code"),
         }
         _weather_cache["ts"] = datetime.now(timezone.utc)
-        _weather_cache["data"] = payload
-        return payload
+        _weather_cache["data"] = orjson.dumps(payload)
+        return Response(_weather_cache["data"], media_type="application/json")
     except Exception as e:
         log.warning("weather fetch failed: %s", e)
-        return JSONResponse({"error": str(e)}, status_code=502)
+        return ORJSONResponse({"error": str(e)}, status_code=502)
 
 
 # -----------------------------------------------------------------------------
 # Eco-Konfig – /api/config/eco
 # -----------------------------------------------------------------------------
+class EcoSettings(BaseModel):
+    # Beide Felder optional: nur gesetzte Werte werden übernommen
+    sunny_kw: Optional[float] = Field(None, ge=0.0, le=22.0)
+    cloudy_kw: Optional[float] = Field(None, ge=0.0, le=22.0)
+
+
 @app.get("/api/config/eco")
-def get_eco_config():
-    return ECO_CONFIG
+async def get_eco_config():
+    return ORJSONResponse(ECO_CONFIG)
 
 
 @app.post("/api/config/eco")
-async def set_eco_config(body: Dict[str, Any]):
-    sunny = body.get("sunny_kw")
-    cloudy = body.get("cloudy_kw")
-    if isinstance(sunny, (int, float)):
-        ECO_CONFIG["sunny_kw"] = clamp(float(sunny), 0.0, 22.0)
-    if isinstance(cloudy, (int, float)):
-        ECO_CONFIG["cloudy_kw"] = clamp(float(cloudy), 0.0, 22.0)
-    return {"ok": True, **ECO_CONFIG}
+async def set_eco_config(body: EcoSettings):
+    if body.sunny_kw is not None:
+        ECO_CONFIG["sunny_kw"] = body.sunny_kw
+    if body.cloudy_kw is not None:
+        ECO_CONFIG["cloudy_kw"] = body.cloudy_kw
+    return ORJSONResponse({"ok": True, **ECO_CONFIG})
 
 
 # -----------------------------------------------------------------------------
 # Points / Status
 # -----------------------------------------------------------------------------
 @app.get("/api/points")
-def api_points():
+async def api_points():
     # Liste aller Ladepunkte
-    return list(cp_status.values())
+    return ORJSONResponse([st.as_dict() for st in cp_status.values()])
 
 
 @app.get("/api/points/{cp_id}")
-def api_point(cp_id: str):
+async def api_point(cp_id: str):
     st = cp_status.get(cp_id)
-    if not st:
-        return JSONResponse({"error": "not found"}, status_code=404)
-    return st
+    if st is None:
+        return ORJSONResponse({"error": "not found"}, status_code=404)
+    return ORJSONResponse(st.as_dict())
 
 
 @app.get("/api/stats")
-def api_stats():
-    total_points = len(cp_status)
-    active = sum(1 for s in cp_status.values() if s.get("status") not in (None, "disconnected", "unknown"))
-    return {"points_total": total_points, "points_active": active, "time": now_iso()}
+async def api_stats():
+    # max. eine Berechnung pro Clock-Tick; Dashboard-Polls dazwischen bekommen die fertigen Bytes
+    ts = now_iso()
+    if _stats_cache["ts"] != ts:
+        total_points = len(cp_status)
+        active = sum(1 for s in cp_status.values() if s.status not in ("disconnected", "unknown"))
+        _stats_cache["data"] = orjson.dumps({"points_total": total_points, "points_active": active, "time": ts})
+        _stats_cache["ts"] = ts
+    return Response(_stats_cache["data"], media_type="application/json")
 
 
 # -----------------------------------------------------------------------------
@@ -529,28 +451,38 @@ async def post_boost(cp_id: str, body: Dict[str, Any]):
 async def set_kw(cp_id: str, body: Dict[str, Any]):
     """Manuelles kW-Setzen vom Frontend."""
     if "kw" not in body:
-        return JSONResponse({"error": "kw missing"}, status_code=400)
+        return ORJSONResponse({"error": "kw missing"}, status_code=400)
     kw = clamp(float(body["kw"]), 0.0, 22.0)
     return await _apply_limit(cp_id, kw)
 
 
+@app.post("/api/broadcast/limit")
+async def broadcast_limit(body: Dict[str, Any]):
+    """Setzt dasselbe kW-Limit auf allen verbundenen Ladepunkten."""
+    if "kw" not in body:
+        return ORJSONResponse({"error": "kw missing"}, status_code=400)
+    kw = clamp(float(body["kw"]), 0.0, 22.0)
+    cps = list(cp_registry.values())
+    await broadcast_limit_kw(cps, kw)
+    return ORJSONResponse({"ok": True, "target_kw": round(kw, 3), "points": [cp.id for cp in cps]})
+
+
 async def _apply_limit(cp_id: str, kw: float):
     cp = cp_registry.get(cp_id)
     if not cp:
-        return JSONResponse({"error": "charger not connected"}, status_code=409)
+        return ORJSONResponse({"error": "charger not connected"}, status_code=409)
     await cp.push_limit_kw(kw)
-    st = cp_status.get(cp_id) or {"id": cp_id}
-    st["target_kw"] = round(kw, 3)
-    st["last_seen"] = now_iso()
-    cp_status[cp_id] = st
-    return {"ok": True, "id": cp_id, "target_kw": st["target_kw"], "last_profile_status": st.get("last_profile_status")}
+    st = cp_status[cp_id]
+    st.target_kw = round(kw, 3)
+    st.last_seen = now_iso()
+    return ORJSONResponse({"ok": True, "id": cp_id, "target_kw": st.target_kw, "last_profile_status": st.last_profile_status})
 
 
 # -----------------------------------------------------------------------------
 # Debug-Routen
 # -----------------------------------------------------------------------------
 @app.get("/debug/routes")
-def debug_routes():
+async def debug_routes():
     routes = []
     for r in app.router.routes:
         try:
@@ -560,4 +492,4 @@ def debug_routes():
         except Exception:
             pass
     routes.sort(key=lambda x: x["path"])
-    return routes
+    return ORJSONResponse(routes)
@@ -1,10 +1,10 @@
-from typing import Dict, Optional, Literal, List, Tuple
+from typing import Any, Dict, Optional, Literal, List, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 
 Mode = Literal["eco", "max", "off", "price", "manual"]
 
-@dataclass
+@dataclass(slots=True)
 class ChargePointState:
     id: str
     connected: bool = False
@@ -45,5 +45,35 @@ class ChargePointState:
     session_kwh: Optional[float] = None
     session_est_end_at: Optional[datetime] = None
 
+@dataclass(slots=True)
+class CPStatus:
+    """Live-Status eines Ladepunkts aus OCPP-Sicht (Basis für /api/points)."""
+    id: str
+    status: str = "unknown"
+    last_seen: Optional[str] = None
+    vendor: Optional[str] = None
+    model: Optional[str] = None
+    error_code: Optional[str] = None
+
+    # Transaktion / Messwerte
+    tx_active: bool = False
+    session: Optional[Dict[str, Any]] = None
+    energy_kwh_session: Optional[float] = None
+    power_kw: Optional[float] = None
+    soc: Optional[int] = None
+
+    # Letztes gepushtes Limit
+    target_kw: Optional[float] = None
+    last_profile_status: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        # Messwerte werden roh gespeichert; auf Anzeigegenauigkeit erst hier runden
+        d = {f: getattr(self, f) for f in self.__slots__}
+        if self.power_kw is not None:
+            d["power_kw"] = round(self.power_kw, 3)
+        if self.energy_kwh_session is not None:
+            d["energy_kwh_session"] = round(self.energy_kwh_session, 3)
+        return d
+
 STATE: Dict[str, ChargePointState] = {}
 ENERGY_LOGS: Dict[str, List[Tuple[datetime, float]]] = {}
@@ -1,217 +1,370 @@
 # backend/ocpp_cs.py
 import os
+import re
+import json
+import asyncio
 import logging
+import time
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 
+import orjson
+import ocpp.messages
 from ocpp.v16 import call, call_result
 from ocpp.v16 import ChargePoint as V16ChargePoint
 from ocpp.v16.enums import RegistrationStatus
 from ocpp.routing import on
 
+from models import CPStatus
+
 log = logging.getLogger("ocpp")
 
-def _iso_now() -> str:
-    return datetime.now(timezone.utc).isoformat()
+# Netzparameter für Limit-Berechnung
+PHASES = int(os.getenv("PHASES", "3") or "3")
+VOLTAGE = float(os.getenv("VOLTAGE", "230") or "230")
+# kW -> A bei Standard-Netzparametern; einmal berechnet, pro Push nur noch eine Multiplikation.
+# Bei PHASES/VOLTAGE <= 0 kein Faktor, damit nicht schon der Import scheitert;
+# kw_to_amps() rechnet dann pro Aufruf und wirft dort wie vor der Vorberechnung.
+AMPS_PER_KW: Optional[float] = 1000.0 / (VOLTAGE * PHASES) if VOLTAGE > 0 and PHASES > 0 else None
+if AMPS_PER_KW is None:
+    log.error("invalid grid config PHASES=%s VOLTAGE=%s (must be > 0)", PHASES, VOLTAGE)
+# Max. gleichzeitige SetChargingProfile-Pushes bei broadcast_limit_kw
+BROADCAST_CONCURRENCY = 32
+
+# Zeitstempel-Cache: höchstens alle _CLOCK_TTL Sekunden neu formatiert, egal wie
+# viele Handler/Requests dazwischen now_iso() aufrufen. Kein Hintergrund-Task nötig.
+_CLOCK_TTL = 0.25
+_TS_CACHE: Dict[str, Any] = {"iso": "", "mono": float("-inf")}
+
+
+def now_iso() -> str:
+    t = time.monotonic()
+    if t - _TS_CACHE["mono"] >= _CLOCK_TTL:
+        _TS_CACHE["iso"] = datetime.now(timezone.utc).isoformat()
+        _TS_CACHE["mono"] = t
+    return _TS_CACHE["iso"]
+
 
 def _round01(x: float) -> float:
-    # auf 0,1 A runden (viele EVSE verlangen Limit in 0,1A)
-    return round(x * 10.0) / 10.0
+    return int(x * 10.0 + (0.5 if x >= 0 else -0.5)) / 10.0
+
+
+# Live-Status aller bekannten Ladepunkte (Eintrag entsteht beim ersten cp_status[id])
+class _StatusTable(dict):
+    """cp_status[id] legt den Eintrag beim ersten Zugriff an (get() bleibt lesend)."""
 
-# Live-Status aller bekannten Ladepunkte
-cp_status: Dict[str, Dict[str, Any]] = {}
+    def __missing__(self, cp_id: str) -> CPStatus:
+        st = self[cp_id] = CPStatus(cp_id)
+        return st
+
+
+cp_status: Dict[str, CPStatus] = _StatusTable()
 # Laufende ChargePoint-Instanzen (für SetChargingProfile etc.)
 cp_registry: Dict[str, "CentralSystem"] = {}
 
-# Optional: Whitelist (leer = alle zulassen)
-KNOWN_CP_IDS = set([os.getenv("CP_ID", "504000093")]) if os.getenv("CP_ID") else set()
 
+@lru_cache(maxsize=64)
 def normalize_status(s: Optional[str]) -> str:
+    # wenige OCPP-Stati -> gecacht; gleiche Eingabe liefert dasselbe String-Objekt
     if not s:
         return "unknown"
     s = s.strip()
     return s.replace(" ", "_").replace("-", "_").lower()
 
+
+def kw_to_amps(kw: float, phases: Optional[int] = None, voltage: Optional[float] = None) -> float:
+    # typisches Mindestlimit: 6 A, viele EVSE akzeptieren 0,1 A Schritte
+    if phases is None and voltage is None and AMPS_PER_KW is not None:
+        factor = AMPS_PER_KW
+    else:
+        factor = 1000.0 / ((voltage or VOLTAGE) * (phases or PHASES))
+    return max(6.0, _round01(kw * factor))
+
+
+def build_tx_profile(kw: float, phases: Optional[int] = None, voltage: Optional[float] = None) -> Dict[str, Any]:
+    """TxProfile (Ampere) für eine kW-Vorgabe."""
+    return _tx_profile(kw_to_amps(kw, phases, voltage), phases or PHASES)
+
+
+def _tx_profile(amps: float, ph: int) -> Dict[str, Any]:
+    return {
+        "chargingProfileId": 2001,
+        "stackLevel": 2,
+        "chargingProfilePurpose": "TxProfile",
+        "chargingProfileKind": "Absolute",
+        "chargingSchedule": {
+            "chargingRateUnit": "A",
+            "chargingSchedulePeriod": [
+                {"startPeriod": 0, "limit": amps, "numberPhases": ph}
+            ],
+        },
+    }
+
+
+async def broadcast_limit_kw(cps: List["CentralSystem"], kw: float) -> None:
+    """Gleiches Limit an mehrere Ladepunkte: Profil einmal bauen, Pushes parallel."""
+    profile = build_tx_profile(kw)
+    # begrenzt, damit eine große Flotte nicht alle Sockets gleichzeitig vollschreibt
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def _one(cp: "CentralSystem") -> None:
+        async with sem:
+            await cp.push_limit_kw(kw, profile=profile)
+
+    await asyncio.gather(*(_one(cp) for cp in cps), return_exceptions=True)
+
+
+# -----------------------------------------------------------------------------
+# OCPP JSON-Codec
+# -----------------------------------------------------------------------------
+class _OrjsonCodec:
+    """Ersetzt das json-Modul nur innerhalb von ocpp.messages.
+
+    Frames ohne Sonderoptionen laufen über orjson; Aufrufe mit parse_float
+    (Decimal-Validierung) und Payloads mit Decimal fallen auf json zurück.
+    """
+
+    JSONDecodeError = json.JSONDecodeError
+    JSONEncoder = json.JSONEncoder
+
+    @staticmethod
+    def loads(s: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs: Any) -> str:
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            return json.dumps(obj, **kwargs)
+
+
+ocpp.messages.json = _OrjsonCodec
+
+
+# -----------------------------------------------------------------------------
+# OCPP Central System
+# -----------------------------------------------------------------------------
+@lru_cache(maxsize=64)
+def _norm(s: Optional[str]) -> str:
+    """Measurand/Unit normalisieren; die Wertemenge ist klein, daher gecacht."""
+    return s.strip().lower() if s else ""
+
+
+# Measurand -> Art des Messwerts; Direkttreffer ohne Teilstring-Suche.
+# Spec-Schreibweise zuerst, damit der Normalfall ohne _norm() auskommt.
+_MEASURAND_KIND: Dict[str, str] = {
+    "Power.Active.Import": "power",
+    "Energy.Active.Import.Register": "energy",
+    "SoC": "soc",
+    "power.active.import": "power",
+    "energy.active.import.register": "energy",
+    "soc": "soc",
+}
+# Einheiten, die keine Umrechnung brauchen (sonst W bzw. kWh angenommen)
+_KW_UNITS = frozenset(("kw",))
+_WH_UNITS = frozenset(("wh",))
+
+
+def _parse_soc(val: float) -> Optional[int]:
+    """SoC auf 0..100 % begrenzen; NaN -> None."""
+    if val != val:
+        return None
+    return 0 if val < 0 else 100 if val > 100 else int(val)
+
+
+# CALL-Frame eines Heartbeat: [2,"<id>","Heartbeat",{}]
+_HEARTBEAT_RE = re.compile(r'\s*\[\s*2\s*,\s*"([^"\\]{1,36})"\s*,\s*"Heartbeat"\s*,\s*\{\s*\}\s*\]\s*')
+# Leere Antworten ohne Zustand: einmal anlegen, ocpp liest sie nur (asdict)
+_STATUS_RESULT = call_result.StatusNotificationPayload()
+_METER_VALUES_RESULT = call_result.MeterValuesPayload()
+_STOP_TX_RESULT = call_result.StopTransactionPayload()
+
+
+@lru_cache(maxsize=4)
+def _boot_result(ts: str) -> call_result.BootNotificationPayload:
+    # ändert sich nur mit dem Clock-Tick; bei Massen-Reconnect teilen sich alle Boots eine Antwort
+    return call_result.BootNotificationPayload(current_time=ts, interval=30, status=RegistrationStatus.accepted)
+
+
 class CentralSystem(V16ChargePoint):
     """
     OCPP 1.6 Central System (Server-Seite), kompatibel mit ocpp==0.17.0.
     """
     def __init__(self, id: str, connection):
         super().__init__(id, connection)
+        # Status-Eintrag einmal holen; Handler setzen Attribute direkt (gleiches Objekt wie in cp_status)
+        self._st = cp_status[id]
+        # Heartbeat-Antwort wiederverwenden; ocpp serialisiert sie direkt nach dem Handler
+        self._hb_result = call_result.HeartbeatPayload(current_time="")
+        # Profil je Ladepunkt einmal bauen; pro Push nur Limit/Phasen überschreiben.
+        # call() serialisiert synchron vor dem ersten await, das Mutieren ist daher sicher.
+        # Ohne kW->A-Umrechnung: ein ungültiges PHASES/VOLTAGE trifft erst den Push, nicht den Connect.
+        self._profile = _tx_profile(0.0, PHASES)
+        self._period = self._profile["chargingSchedule"]["chargingSchedulePeriod"][0]
 
-    # ----------------------
-    # Helpers / Profile Push
-    # ----------------------
-    async def push_limit_kw(self, kw: float, connector_id: int = 1, phases: Optional[int] = None, voltage: Optional[float] = None):
-        """Pusht ein TxProfile-Limit in Ampere basierend auf kW-Vorgabe."""
-        try:
-            phases = phases or int(os.getenv("PHASES", "3"))
-        except Exception:
-            phases = 3
-        try:
-            voltage = voltage or float(os.getenv("VOLTAGE", "230"))
-        except Exception:
-            voltage = 230.0
-
-        # Mindeststrom ≥ 6 A (typisch), 0,1 A Schrittweite
-        limit_amps = max(6.0, _round01((kw * 1000.0) / (voltage * phases)))
-
-        profile = {
-            "chargingProfileId": 2001,
-            "stackLevel": 2,
-            "chargingProfilePurpose": "TxProfile",
-            "chargingProfileKind": "Absolute",
-            "chargingSchedule": {
-                "chargingRateUnit": "A",
-                "chargingSchedulePeriod": [
-                    {"startPeriod": 0, "limit": limit_amps, "numberPhases": phases}
-                ],
-            },
-        }
+    async def route_message(self, raw_msg):
+        # Heartbeat (leere Payload) direkt beantworten, ohne unpack/Validierung/Router
+        m = _HEARTBEAT_RE.fullmatch(raw_msg) if '"Heartbeat"' in raw_msg[:80] else None
+        if m is None:
+            return await super().route_message(raw_msg)
+        now = now_iso()
+        self._st.last_seen = now
+        await self._send(f'[3,"{m.group(1)}",{{"currentTime":"{now}"}}]')
 
-        req = call.SetChargingProfile(connector_id=connector_id, cs_charging_profiles=profile)
+    async def push_limit_kw(self, kw: float, connector_id: int = 1, phases: Optional[int] = None, voltage: Optional[float] = None, profile: Optional[Dict[str, Any]] = None):
+        """Pusht ein TxProfile-Limit (Ampere) basierend auf kW."""
+        if profile is None:
+            self._period["limit"] = kw_to_amps(kw, phases, voltage)
+            self._period["numberPhases"] = phases or PHASES
+            profile = self._profile
+        amps = profile["chargingSchedule"]["chargingSchedulePeriod"][0]["limit"]
         try:
-            res = await self.call(req)
-            st = cp_status.get(self.id) or {"id": self.id}
-            st["target_kw"] = round(kw, 3)
-            st["last_seen"] = _iso_now()
-            st["last_profile_status"] = getattr(res, "status", "")
-            cp_status[self.id] = st
-            log.info("%s: SetChargingProfile sent (%.1f A ~ %.2f kW) -> %s", self.id, limit_amps, kw, getattr(res, "status", ""))
+            res = await self.call(call.SetChargingProfilePayload(connector_id=connector_id, cs_charging_profiles=profile))
+            st = self._st
+            st.target_kw = round(kw, 3)
+            st.last_profile_status = getattr(res, "status", "")
+            st.last_seen = now_iso()
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    "%s: SetChargingProfile sent (%.1f A ~ %.2f kW) -> %s",
+                    self.id,
+                    amps,
+                    kw,
+                    st.last_profile_status,
+                )
         except Exception as e:
-            log.warning("push profile %s failed: %s", self.id, e)
+            log.warning("%s: push profile failed: %s", self.id, e)
 
     async def clear_profile(self, connector_id: int = 1):
         try:
-            await self.call(call.ClearChargingProfile(connector_id=connector_id))
+            await self.call(call.ClearChargingProfilePayload(connector_id=connector_id))
             log.info("%s: ClearChargingProfile ok", self.id)
         except Exception as e:
             log.warning("%s: ClearChargingProfile failed: %s", self.id, e)
 
-    # ----------------------
-    # OCPP Request Handler
-    # ----------------------
+    # -------------------- OCPP Handlers --------------------
+    # Handler ohne await sind bewusst synchron: ocpp ruft sie direkt auf und
+    # awaited nur, wenn ein Awaitable zurückkommt -> kein Coroutine-Objekt pro Nachricht.
     @on("BootNotification")
-    async def on_boot(self, charge_point_vendor: str, charge_point_model: str, **kwargs):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["vendor"] = charge_point_vendor
-        st["model"] = charge_point_model
-        st["status"] = "available"  # Initialstatus; echte Stati kommen per StatusNotification
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
-
+    def on_boot(self, charge_point_vendor: str, charge_point_model: str, **kwargs):
+        st = self._st
+        st.vendor = charge_point_vendor
+        st.model = charge_point_model
+        st.status = "available"
+        st.last_seen = now_iso()
         log.info("%s: BootNotification model=%s vendor=%s", self.id, charge_point_model, charge_point_vendor)
-        return call_result.BootNotificationPayload(
-            current_time=_iso_now(),
-            interval=30,
-            status=RegistrationStatus.accepted,
-        )
+        return _boot_result(now_iso())
 
     @on("Heartbeat")
-    async def on_heartbeat(self):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
-        return call_result.HeartbeatPayload(current_time=_iso_now())
+    def on_heartbeat(self):
+        self._st.last_seen = self._hb_result.current_time = now_iso()
+        return self._hb_result
 
     @on("StatusNotification")
-    async def on_status(self, connector_id: int, error_code: str, status: str, **kwargs):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["status"] = normalize_status(status)
-        st["error_code"] = error_code
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
-        return call_result.StatusNotificationPayload()
+    def on_status(self, connector_id: int, error_code: str, status: str, **kwargs):
+        st = self._st
+        st.status = normalize_status(status)
+        st.error_code = error_code
+        st.last_seen = now_iso()
+        return _STATUS_RESULT
 
     @on("StartTransaction")
-    async def on_start_transaction(self, connector_id: int, id_tag: str, timestamp: str, meter_start: int, reservation_id: Optional[int] = None):
-        st = cp_status.get(self.id) or {"id": self.id}
-        st["tx_active"] = True
-        st["session"] = {
-            "start": timestamp or _iso_now(),
+    def on_start_transaction(self, connector_id: int, id_tag: str, timestamp: str, meter_start: int, reservation_id: Optional[int] = None):
+        st = self._st
+        st.tx_active = True
+        st.session = {
+            "start": timestamp or now_iso(),
             "end": None,
             "est_end": None,
             "start_meter_wh": float(meter_start),
             "last_meter_wh": float(meter_start),
         }
-        st["energy_kwh_session"] = 0.0
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
+        st.energy_kwh_session = 0.0
+        st.last_seen = now_iso()
         log.info("%s: StartTransaction meter_start=%.1f Wh", self.id, float(meter_start))
         return call_result.StartTransactionPayload(transaction_id=1, id_tag_info={"status": "Accepted"})
 
     @on("MeterValues")
-    async def on_meter_values(self, connector_id: int, meter_value: list, transaction_id: Optional[int] = None):
+    def on_meter_values(self, connector_id: int, meter_value: list, transaction_id: Optional[int] = None):
         power_kw = None
         soc = None
         latest_energy_wh = None
 
         for mv in meter_value or []:
-            for sv in mv.get("sampledValue", []) or []:
-                meas = (sv.get("measurand") or "").strip()
-                unit = (sv.get("unit") or "").strip()
-                val_str = sv.get("value")
-                try:
-                    val = float(val_str)
-                except Exception:
-                    continue
-
-                m = meas.lower()
-                if "power.active.import" in m:
-                    power_kw = val if unit.lower() == "kw" else val / 1000.0
-                elif "energy.active.import.register" in m:
-                    latest_energy_wh = val if unit.lower() == "wh" else val * 1000.0
-                elif m == "soc" or meas == "SoC":
+            # ocpp wandelt Keys rekursiv in snake_case -> "sampled_value"
+            for sv in (mv.get("sampled_value") or mv.get("sampledValue") or []):
+                val = sv.get("value")
+                if type(val) is not float:
                     try:
-                        soc = int(val)
-                    except Exception:
-                        pass
+                        val = float(val)
+                    except (TypeError, ValueError):
+                        continue
+                meas = sv.get("measurand")
+                kind = _MEASURAND_KIND.get(meas)
+                if kind is None:
+                    lower = _norm(meas)
+                    kind = _MEASURAND_KIND.get(lower)
+                if kind is None:
+                    # seltene Varianten (z.B. Herstellerpräfixe) per Teilstring
+                    if "power.active.import" in lower:
+                        kind = "power"
+                    elif "energy.active.import.register" in lower:
+                        kind = "energy"
+                    else:
+                        continue
+                unit = _norm(sv.get("unit"))
+                if kind == "power":
+                    power_kw = val if unit in _KW_UNITS else val * 0.001
+                elif kind == "energy":
+                    latest_energy_wh = val if unit in _WH_UNITS else val * 1000.0
+                else:
+                    parsed = _parse_soc(val)
+                    if parsed is not None:
+                        soc = parsed
 
-        st = cp_status.get(self.id) or {"id": self.id}
-        sess = st.get("session") or {}
+        st = self._st
+        sess = st.session or {}
 
         if latest_energy_wh is not None:
             if "start_meter_wh" not in sess or sess.get("start_meter_wh") is None:
                 sess["start_meter_wh"] = latest_energy_wh
             sess["last_meter_wh"] = latest_energy_wh
             diff_wh = max(0.0, latest_energy_wh - float(sess.get("start_meter_wh") or 0.0))
-            st["energy_kwh_session"] = round(diff_wh / 1000.0, 3)
-            st["session"] = sess
+            st.energy_kwh_session = diff_wh * 0.001
+            st.session = sess
 
         if power_kw is not None:
-            st["power_kw"] = round(power_kw, 3)
-
+            st.power_kw = power_kw
         if soc is not None:
-            st["soc"] = soc
-
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
+            st.soc = soc
 
-        return call_result.MeterValuesPayload()
+        st.last_seen = now_iso()
+        return _METER_VALUES_RESULT
 
     @on("StopTransaction")
-    async def on_stop_transaction(self, transaction_id: int, id_tag: str, timestamp: str, meter_stop: int, transaction_data: Optional[list] = None, reason: Optional[str] = None):
-        st = cp_status.get(self.id) or {"id": self.id}
-        sess = st.get("session") or {}
+    def on_stop_transaction(self, transaction_id: int, id_tag: str, timestamp: str, meter_stop: int, transaction_data: Optional[list] = None, reason: Optional[str] = None):
+        st = self._st
+        sess = st.session or {}
         try:
             stop_wh = float(meter_stop)
             if "start_meter_wh" in sess and sess.get("start_meter_wh") is not None:
                 diff_wh = max(0.0, stop_wh - float(sess["start_meter_wh"]))
-                st["energy_kwh_session"] = round(diff_wh / 1000.0, 3)
+                st.energy_kwh_session = diff_wh * 0.001
             sess["last_meter_wh"] = stop_wh
         except Exception:
             pass
-
-        sess["end"] = timestamp or _iso_now()
-        st["session"] = sess
-        st["tx_active"] = False
-        st["last_seen"] = _iso_now()
-        cp_status[self.id] = st
-        log.info("%s: StopTransaction energy_kwh_session=%.3f", self.id, st.get("energy_kwh_session", 0.0))
-        return call_result.StopTransactionPayload()
+        sess["end"] = timestamp or now_iso()
+        st.session = sess
+        st.tx_active = False
+        st.last_seen = now_iso()
+        log.info("%s: StopTransaction energy_kwh_session=%.3f", self.id, st.energy_kwh_session or 0.0)
+        return _STOP_TX_RESULT
 
     @on("DataTransfer")
-    async def on_data_transfer(self, vendor_id: str, message_id: Optional[str] = None, data: Optional[str] = None):
-        # KEBA sendet gelegentlich DataTransfer; wir bestätigen neutral
+    def on_data_transfer(self, vendor_id: str, message_id: Optional[str] = None, data: Optional[str] = None):
         log.debug("%s: DataTransfer vendor_id=%s message_id=%s", self.id, vendor_id, message_id)
         return call_result.DataTransferPayload(status="Accepted")
@@ -1,11 +1,36 @@
 import os, logging, aiohttp
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timezone, timedelta
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 log = logging.getLogger(__name__)
 
 AWATTAR_DE = "https://api.awattar.de/v1/marketdata"
 
+# Slot-Raster und Zeitfenster um "now" (einmal angelegt statt pro Schleifendurchlauf)
+_SLOT = timedelta(minutes=15)
+_WINDOW = timedelta(hours=36)
+
+def _slot_ts(p: Tuple[datetime, float]) -> datetime:
+    return p[0]
+
+# Eine Session für alle Abrufe: Connection-Pool/Keep-Alive statt neuem Handshake pro Call
+_http: Optional[aiohttp.ClientSession] = None
+
+def _session() -> aiohttp.ClientSession:
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=12))
+    return _http
+
+# Ergebnis je 15-Minuten-Slot: Aufrufe im selben Slot sparen HTTP-Roundtrip + Parse
+_cache: Dict[str, Any] = {"bucket": None, "data": None}
+
+async def close_session() -> None:
+    """Beim Shutdown aufrufen, damit der Pool sauber geschlossen wird."""
+    if _http is not None and not _http.closed:
+        await _http.close()
+
 def _to_dt_ms(ms: int) -> datetime:
     # aWATTar liefert ms seit Epoche (UTC)
     return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc)
@@ -16,13 +41,16 @@ async def fetch_prices_ct_per_kwh(now: datetime) -> List[Tuple[datetime, float]]
     und expandiert Stundenpreise in 15-Minuten-Slots (flach).
     Rückgabe: Liste[(ts_start, ct_per_kwh)] in UTC, auf +-36h um now begrenzt.
     """
+    bucket = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+    if _cache["bucket"] == bucket:
+        return _cache["data"]
+
     url = os.getenv("PRICE_API_URL", AWATTAR_DE)
     params = {}  # aWATTar ohne Key, optional könnten time_from/time_to gesetzt werden
     try:
-        async with aiohttp.ClientSession() as s:
-            async with s.get(url, params=params, timeout=12) as r:
-                r.raise_for_status()
-                j = await r.json()
+        async with _session().get(url, params=params) as r:
+            r.raise_for_status()
+            j = await r.json()
     except Exception as e:
         log.exception("price fetch failed: %s", e)
         return []
@@ -32,6 +60,8 @@ async def fetch_prices_ct_per_kwh(now: datetime) -> List[Tuple[datetime, float]]
         log.warning("unexpected price payload shape: %s", type(j))
         return []
 
+    lo = now - _WINDOW
+    hi = now + _WINDOW
     out: List[Tuple[datetime, float]] = []
     for item in data:
         # aWATTar Felder: start_timestamp, end_timestamp (ms), marketprice (EUR/MWh)
@@ -42,18 +72,23 @@ async def fetch_prices_ct_per_kwh(now: datetime) -> List[Tuple[datetime, float]]
             ct_per_kwh = eur_per_mwh / 10.0  # 1 EUR/MWh = 0.1 ct/kWh
         except Exception:
             continue
+        # Stunden komplett außerhalb des Fensters gar nicht erst expandieren
+        if end <= lo or start > hi:
+            continue
 
         # Stundenpreis auf 15-Minuten-Slots verteilen: start, +15, +30, +45
         slot = start
         while slot < end:
             out.append((slot, ct_per_kwh))
-            slot = slot + timedelta(minutes=15)
+            slot += _SLOT
 
     # sortieren und auf +-36h um now beschränken
-    out.sort(key=lambda x: x[0])
-    lo = now - timedelta(hours=36)
-    hi = now + timedelta(hours=36)
-    out = [p for p in out if lo <= p[0] <= hi]
+    out.sort(key=_slot_ts)
+    out = out[bisect_left(out, lo, key=_slot_ts):bisect_right(out, hi, key=_slot_ts)]
+    # leere Ergebnisse nicht cachen, damit der nächste Aufruf es erneut versucht
+    if out:
+        _cache["bucket"] = bucket
+        _cache["data"] = out
     return out
 
 def median(values: list[float]) -> float:
@@ -7,7 +7,7 @@ from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 from models import STATE
-from mailer import send_mail, fmt_ts
+from mailer import enqueue_mail
 from price_provider import fetch_prices_ct_per_kwh, median
 
 log = logging.getLogger(__name__)
@@ -24,8 +24,13 @@ PRICE_REFRESH_SECONDS   = int(os.getenv("PRICE_REFRESH_SECONDS", "300"))
 WEATHER_REFRESH_SECONDS = int(os.getenv("WEATHER_REFRESH_SECONDS", "120"))
 PUSH_DEADBAND_KW        = float(os.getenv("PUSH_DEADBAND_KW", "0.1"))
 
+# Mail-Template; ausgefüllt wird erst im Mail-Worker
+SOC_REACHED_BODY = "Ladepunkt: %s\nSoC: %s%% (Ziel %s%%)\nZeit: %s\n"
+
 def clamp_kw(x: float) -> float:
-    return max(MIN_KW, min(MAX_KW, float(x)))
+    x = float(x)
+    # NaN landet wie bei max/min auf MAX_KW (x <= MAX_KW ist False)
+    return MIN_KW if x < MIN_KW else x if x <= MAX_KW else MAX_KW
 
 async def fetch_radiation(lat: float, lon: float) -> Tuple[float, float]:
     url = (
@@ -209,10 +214,10 @@ async def control_loop(app, lat: float, lon: float, base_limit_kw: float):
                         hours_left = max(0.0, (cutoff - now_local).total_seconds() / 3600.0)
                         if st.current_soc is not None and st.current_soc >= st.boost_target_soc and not st.boost_reached_notified:
                             st.boost_reached_notified = True
-                            asyncio.create_task(send_mail(
-                                f"[EMS] Ziel-SoC erreicht – {cp_id}",
-                                f"Ladepunkt: {cp_id}\nSoC: {st.current_soc}% (Ziel {st.boost_target_soc}%)\nZeit: {fmt_ts()}\n"
-                            ))
+                            enqueue_mail(
+                                f"[EMS] Ziel-SoC erreicht – {cp_id}", SOC_REACHED_BODY,
+                                cp_id, st.current_soc, st.boost_target_soc, datetime.now(timezone.utc),
+                            )
                         if hours_left > 0.0:
                             soc_now = float(st.current_soc if st.current_soc is not None else (st.soc or 0))
                             need_soc = max(0.0, st.boost_target_soc - soc_now)